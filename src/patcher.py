@@ -2,74 +2,127 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import contextlib
+import json
+import mmap
+import os
+import shutil
+import struct
 import sys
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Iterator, NamedTuple, Optional, Tuple, Union
+
+
+class Patch(NamedTuple):
+    """单个补丁版本的配置"""
+    description: str
+    target: bytes
+    replacement: bytes
+
+
+# 被搜索的文件内容：通常是只读mmap，文件系统不支持mmap时退回到bytearray
+_Buffer = Union[mmap.mmap, bytearray]
+
+# 扫描结果缓存：缓存键 -> {"version", "offset", "patched", "detected"}，见下方“扫描结果缓存”一节
+_ScanCache = Dict[str, Dict[str, object]]
+
 
 # ==============================================================================
 # 补丁配置区域
 #
 # 在这里定义你所有不同的补丁版本。
-# 每个补丁都是一个字典，包含:
-#   - "description": (str) 对这个补丁的简短描述，会显示给用户。
-#   - "target": (bytes) 要在.so文件中搜索的目标二进制指令串。
-#   - "replacement": (bytes) 用于替换目标二进制串的新指令串。
+# 每个补丁都是一个 Patch，包含:
+#   - description: (str) 对这个补丁的简短描述，会显示给用户。
+#   - target: (bytes) 要在.so文件中搜索的目标二进制指令串。
+#   - replacement: (bytes) 用于替换目标二进制串的新指令串。
 #
-# **重要**: 为了保证二进制文件的结构不被破坏，"target" 和 "replacement"
+# **重要**: 为了保证二进制文件的结构不被破坏，target 和 replacement
 # 的字节长度必须完全相同。
 # ==============================================================================
-PATCH_CONFIG: List[Dict[str, Any]] = [
+
+# (2024.09 - 2025.06) 各版本的目标指令串完全相同，只定义一次，下面的配置统一引用
+TARGET_W2024 = b'\x55\x48\x89\xe5\x48\x81\xec\x80\x01\x00\x00'
+REPLACEMENT_W2024 = b'\x31\xc0\xc3\xe5\x48\x81\xec\x80\x01\x00\x00'
+
+PATCH_CONFIG: List[Patch] = [
     # (2023.03 - 2023.12) patch只需要覆盖b'\x41\x55\x41\x54\x55\x53'，这里为了防止误patch到其他部分，所以保持完整指令流，都包括进来了
     # 这部分的对应的函数是covdb_get_license，通过b'\xb8\x01\x00\x00\x00\xc3'直接给eax寄存器写1并返回，来跳过函数执行部分
-    {
-        "description": "U-2023.03-SP1",
-        "target": b'\x41\x55\x41\x54\x55\x53\x48\x83\xec\x08\x44\x8b\x25\x67\xec\xdf\x00',
-        "replacement": b'\xb8\x01\x00\x00\x00\xc3\x48\x83\xec\x08\x44\x8b\x25\x67\xec\xdf\x00',
-    },
-    {
-        "description": "U-2023.03-SP2",
-        "target": b'\x41\x55\x41\x54\x55\x53\x48\x83\xec\x08\x44\x8b\x25\x57\x06\xe0\x00',
-        "replacement": b'\xb8\x01\x00\x00\x00\xc3\x48\x83\xec\x08\x44\x8b\x25\x57\x06\xe0\x00',
-    },
-    {
-        "description": "U-2023.12-SP1",
-        "target": b'\x41\x55\x41\x54\x55\x53\x48\x83\xec\x08\x44\x8b\x25\x47\xd0\xee\x00',
-        "replacement": b'\xb8\x01\x00\x00\x00\xc3\x48\x83\xec\x08\x44\x8b\x25\x47\xd0\xee\x00',
-    },
-    {
-        "description": "U-2023.12-SP2",
-        "target": b'\x41\x55\x41\x54\x55\x53\x48\x83\xec\x08\x44\x8b\x25\x07\x0c\xef\x00',
-        "replacement": b'\xb8\x01\x00\x00\x00\xc3\x48\x83\xec\x08\x44\x8b\x25\x07\x0c\xef\x00',
-    },
+    Patch(
+        description="U-2023.03-SP1",
+        target=b'\x41\x55\x41\x54\x55\x53\x48\x83\xec\x08\x44\x8b\x25\x67\xec\xdf\x00',
+        replacement=b'\xb8\x01\x00\x00\x00\xc3\x48\x83\xec\x08\x44\x8b\x25\x67\xec\xdf\x00',
+    ),
+    Patch(
+        description="U-2023.03-SP2",
+        target=b'\x41\x55\x41\x54\x55\x53\x48\x83\xec\x08\x44\x8b\x25\x57\x06\xe0\x00',
+        replacement=b'\xb8\x01\x00\x00\x00\xc3\x48\x83\xec\x08\x44\x8b\x25\x57\x06\xe0\x00',
+    ),
+    Patch(
+        description="U-2023.12-SP1",
+        target=b'\x41\x55\x41\x54\x55\x53\x48\x83\xec\x08\x44\x8b\x25\x47\xd0\xee\x00',
+        replacement=b'\xb8\x01\x00\x00\x00\xc3\x48\x83\xec\x08\x44\x8b\x25\x47\xd0\xee\x00',
+    ),
+    Patch(
+        description="U-2023.12-SP2",
+        target=b'\x41\x55\x41\x54\x55\x53\x48\x83\xec\x08\x44\x8b\x25\x07\x0c\xef\x00',
+        replacement=b'\xb8\x01\x00\x00\x00\xc3\x48\x83\xec\x08\x44\x8b\x25\x07\x0c\xef\x00',
+    ),
     # (2024.09 - 2025.06) patch只需要覆盖b'\x55\x48\x89'，这里为了防止误patch到其他部分，所以保持完整指令流，都包括进来了
     # 这部分的对应的函数是执行一个受互斥锁保护的任务，通过b'\x31\xc0\xc3'直接给eax寄存器写0并返回，来跳过函数执行部分
-    {
-        "description": "W-2024.09",
-        "target": b'\x55\x48\x89\xe5\x48\x81\xec\x80\x01\x00\x00',
-        "replacement": b'\x31\xc0\xc3\xe5\x48\x81\xec\x80\x01\x00\x00',
-    },
-    {
-        "description": "W-2024.09-SP1",
-        "target": b'\x55\x48\x89\xe5\x48\x81\xec\x80\x01\x00\x00',
-        "replacement": b'\x31\xc0\xc3\xe5\x48\x81\xec\x80\x01\x00\x00',
-    },
-    {
-        "description": "W-2024.09-SP2",
-        "target": b'\x55\x48\x89\xe5\x48\x81\xec\x80\x01\x00\x00',
-        "replacement": b'\x31\xc0\xc3\xe5\x48\x81\xec\x80\x01\x00\x00',
-    },
-    {
-        "description": "X-2025.06",
-        "target": b'\x55\x48\x89\xe5\x48\x81\xec\x80\x01\x00\x00',
-        "replacement": b'\x31\xc0\xc3\xe5\x48\x81\xec\x80\x01\x00\x00',
-    },
-    {
-        "description": "X-2025.06-SP1",
-        "target": b'\x55\x48\x89\xe5\x48\x81\xec\x80\x01\x00\x00',
-        "replacement": b'\x31\xc0\xc3\xe5\x48\x81\xec\x80\x01\x00\x00',
-    },
+    Patch(
+        description="W-2024.09",
+        target=TARGET_W2024,
+        replacement=REPLACEMENT_W2024,
+    ),
+    Patch(
+        description="W-2024.09-SP1",
+        target=TARGET_W2024,
+        replacement=REPLACEMENT_W2024,
+    ),
+    Patch(
+        description="W-2024.09-SP2",
+        target=TARGET_W2024,
+        replacement=REPLACEMENT_W2024,
+    ),
+    Patch(
+        description="X-2025.06",
+        target=TARGET_W2024,
+        replacement=REPLACEMENT_W2024,
+    ),
+    Patch(
+        description="X-2025.06-SP1",
+        target=TARGET_W2024,
+        replacement=REPLACEMENT_W2024,
+    ),
     # --- 如果有针对其他版本的补丁，可以在这里继续添加 ---
 ]
 
+def _group_patches(key: Callable[[Patch], bytes]) -> Dict[bytes, List[Patch]]:
+    """
+    按指令串对补丁分组，相同的指令串只需在文件中搜索一次。组内按版本号
+    长度降序排列，防止 'X-2025.06' 抢先匹配到 'X-2025.06-SP1' 的文件。
+    """
+    groups: Dict[bytes, List[Patch]] = {}
+    for patch in PATCH_CONFIG:
+        groups.setdefault(key(patch), []).append(patch)
+    for patches in groups.values():
+        patches.sort(key=lambda p: len(p.description), reverse=True)
+    return groups
+
+
+# 自动识别版本用的分组，导入时只构建一次
+_PATCHES_BY_TARGET = _group_patches(lambda p: p.target)
+_PATCHES_BY_REPLACEMENT = _group_patches(lambda p: p.replacement)
+
+# 判断 .rodata 中是否存有版本号时用到的所有已知版本号；以其他版本号为前缀的
+# 可以省略（例如找到 'X-2025.06' 就足以说明 'X-2025.06-SP1' 所在的区域）
+_KNOWN_VERSION_BYTES = sorted({p.description.encode('ascii') for p in PATCH_CONFIG})
+_KNOWN_VERSION_BYTES = [v for v in _KNOWN_VERSION_BYTES
+                        if not any(v != u and v.startswith(u) for u in _KNOWN_VERSION_BYTES)]
+
+# 菜单内容在导入时预先生成
+_MENU_STR = "\n".join(f"  [{i + 1}] {p.description}" for i, p in enumerate(PATCH_CONFIG))
+
+
 def display_patches() -> None:
     """打印所有可用的补丁选项"""
     print("=" * 50)
@@ -79,12 +132,11 @@ def display_patches() -> None:
         print("  No patches configured. Please edit the script.")
         return
 
-    for i, patch in enumerate(PATCH_CONFIG):
-        print(f"  [{i + 1}] {patch['description']}")
+    print(_MENU_STR)
     print("-" * 50)
 
 
-def select_patch() -> Dict[str, Any]:
+def select_patch() -> Patch:
     """让用户选择一个补丁并返回所选的补丁配置"""
     if len(PATCH_CONFIG) == 1:
         print("Found only one available patch. Auto-selecting it.")
@@ -105,13 +157,104 @@ def select_patch() -> Dict[str, Any]:
             sys.exit(1)
 
 
-def apply_patch(file_path: str, patch_info: Dict[str, Any]) -> bool:
+def find_patch(selector: str) -> Optional[Patch]:
+    """按描述字符串或从1开始的菜单序号查找补丁，找不到时返回None"""
+    if selector.isdecimal():
+        index = int(selector) - 1
+        return PATCH_CONFIG[index] if 0 <= index < len(PATCH_CONFIG) else None
+    for patch in PATCH_CONFIG:
+        if patch.description == selector:
+            return patch
+    return None
+
+
+def _rodata_range(mm: _Buffer) -> Optional[Tuple[int, int]]:
+    """
+    解析ELF64节头表，返回所有 .rodata* 节在文件中覆盖的 [起始, 结束) 范围。
+    不是ELF64小端文件或节头表损坏时返回None。
+    """
+    try:
+        if mm[:6] != b'\x7fELF\x02\x01':
+            return None
+        e_shoff, = struct.unpack_from('<Q', mm, 0x28)
+        e_shentsize, e_shnum, e_shstrndx = struct.unpack_from('<HHH', mm, 0x3a)
+        if e_shentsize < 0x28 or e_shstrndx >= e_shnum:
+            return None
+
+        # sh_offset / sh_size 位于每个节头的 0x18 / 0x20 处，sh_name 位于 0x00
+        strtab_offset, = struct.unpack_from('<Q', mm, e_shoff + e_shstrndx * e_shentsize + 0x18)
+        lo, hi = len(mm), 0
+        for i in range(e_shnum):
+            header = e_shoff + i * e_shentsize
+            sh_name, = struct.unpack_from('<I', mm, header)
+            sh_offset, sh_size = struct.unpack_from('<QQ', mm, header + 0x18)
+            name_start = strtab_offset + sh_name
+            if mm[name_start:name_start + 7] == b'.rodata':
+                lo = min(lo, sh_offset)
+                hi = max(hi, min(sh_offset + sh_size, len(mm)))
+    except struct.error:
+        return None
+    return (lo, hi) if lo < hi else None
+
+
+def _match_version(mm: _Buffer, patches: List[Patch], rodata: Optional[Tuple[int, int]],
+                   trust_rodata: bool = False) -> Optional[Patch]:
+    """
+    按顺序返回第一个版本号出现在文件中的候选补丁，都不匹配时返回None。
+
+    版本号通常位于 .rodata，优先只搜索该区域，找不到时再退回到全文件搜索，
+    保证不会把放在其他节（如 .data）里的版本号误判为不匹配。
+    trust_rodata 为 True 时（仅用于自动识别），只要 .rodata 中存有任何已知
+    版本号就认为版本号都放在这里，候选都不在其中时直接判定不匹配。
+    """
+    if rodata is not None:
+        for patch in patches:
+            if mm.find(patch.description.encode('ascii'), *rodata) != -1:
+                return patch
+        if trust_rodata and any(mm.find(v, *rodata) != -1 for v in _KNOWN_VERSION_BYTES):
+            return None
+    for patch in patches:
+        if mm.find(patch.description.encode('ascii')) != -1:
+            return patch
+    return None
+
+
+def detect_patch(mm: _Buffer) -> Optional[Tuple[Patch, int]]:
+    """
+    根据文件内容自动识别应使用的补丁，返回 (补丁, 目标串偏移)，无法识别时返回None。
+    文件已被Patch时返回的是替换后指令串的偏移。偏移会传给 apply_patch，
+    避免再次搜索。
+    """
+    # 每个不同的目标串只搜索一次，找到且版本号吻合即停止；所有目标串都
+    # 不匹配时，再按替换后的指令串识别已被Patch的文件。
+    # 注意 W-2024 的目标串是普通的函数开头，旧版本的文件里也可能出现，
+    # 因此版本号不吻合时要继续尝试其余的指令串。
+    rodata = _rodata_range(mm)
+    for groups in (_PATCHES_BY_TARGET, _PATCHES_BY_REPLACEMENT):
+        for needle, patches in groups.items():
+            offset = mm.find(needle)
+            if offset == -1:
+                continue
+            # 多个版本可能共用同一指令串，再通过版本号区分
+            patch = _match_version(mm, patches, rodata, trust_rodata=True)
+            if patch is not None:
+                return patch, offset
+    return None
+
+
+def apply_patch(file_path: str, patch_info: Patch, in_place: bool = False,
+                known_offset: Optional[int] = None, cache: Optional[_ScanCache] = None) -> bool:
     """
     核心补丁应用函数。
+
+    默认把结果写到 <file>.patched；in_place 为 True 时直接覆写原文件中的补丁字节。
+    known_offset 是 detect_patch 已找到的目标串（或替换串）偏移：版本号在识别时
+    已确认，这里只核对该偏移处的字节并检查目标串是否唯一。
+    cache 是调用方已读取的扫描结果缓存，未提供时在这里读取。
     """
-    target_bytes = patch_info['target']
-    replacement_bytes = patch_info['replacement']
-    version_string = patch_info['description']
+    target_bytes = patch_info.target
+    replacement_bytes = patch_info.replacement
+    version_string = patch_info.description
 
     if len(target_bytes) != len(replacement_bytes):
         print("=" * 60, file=sys.stderr)
@@ -125,21 +268,206 @@ def apply_patch(file_path: str, patch_info: Dict[str, Any]) -> bool:
     print(f"\n[*] Applying patch for version: '{version_string}'")
     print(f"[*] Target file: {file_path}")
 
+    with _open_mapped(file_path) as mm:
+        if mm is None or not _check_elf_header(mm, file_path):
+            return False
+        if cache is None:
+            cache = _load_scan_cache()
+        return _patch_mapped(mm, file_path, patch_info, in_place, known_offset, cache)
+
+
+def _check_elf_header(mm: _Buffer, file_path: str) -> bool:
+    """
+    确认文件是 x86-64 的 ELF64 共享库。补丁字节是 x86-64 机器码，
+    打到其他架构的文件上即使恰好匹配也会破坏文件。
+    """
+    header = mm[:20]
+    if (header[:4] != b'\x7fELF'
+            or header[4:6] != b'\x02\x01'          # ELFCLASS64, ELFDATA2LSB
+            or header[16:18] != b'\x03\x00'        # ET_DYN
+            or header[18:20] != b'\x3e\x00'):      # EM_X86_64
+        print(f"\n[!] ERROR: '{file_path}' is not an x86-64 ELF64 shared object.")
+        print("[!] Please ensure you are patching the correct file.")
+        return False
+    return True
+
+
+@contextlib.contextmanager
+def _open_mapped(file_path: str) -> Iterator[Optional[_Buffer]]:
+    """_map_file 的上下文管理器版本，退出时关闭mmap"""
+    mm = _map_file(file_path)
+    try:
+        yield mm
+    finally:
+        if isinstance(mm, mmap.mmap):
+            mm.close()
+
+
+def _map_file(file_path: str) -> Optional[_Buffer]:
+    """以只读方式mmap整个文件，失败时打印错误并返回None"""
     try:
         with open(file_path, 'rb') as f:
-            original_data = f.read()
+            # 后续只做顺序向前的搜索，提示内核加大预读窗口（非Linux平台没有这些接口）。
+            # 这些只是提示，失败时忽略即可
+            if hasattr(os, 'posix_fadvise'):
+                with contextlib.suppress(OSError):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            # 使用mmap映射文件，避免将整个.so读入内存
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except OSError:
+                # 部分文件系统（如某些网络/FUSE挂载）不支持mmap，退回到一次性读入，
+                # 直接读进预分配的bytearray，不再额外生成一份bytes拷贝
+                buf = bytearray(os.fstat(f.fileno()).st_size)
+                f.readinto(buf)
+                return buf
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                with contextlib.suppress(OSError):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+            return mm
     except FileNotFoundError:
         print(f"Error: File not found at '{file_path}'", file=sys.stderr)
-        return False
+    except ValueError:
+        # 空文件无法被mmap
+        print(f"Error: File '{file_path}' is empty.", file=sys.stderr)
     except IOError as e:
         print(f"Error reading file '{file_path}': {e}", file=sys.stderr)
-        return False
+    return None
+
+
+# ==============================================================================
+# 扫描结果缓存
+#
+# 以文件的 (路径, 设备号, inode, 大小, mtime) 作为键，记录已确认的版本号、
+# 目标（或替换后）指令串的偏移以及是否已被Patch。同一文件再次运行时，
+# 只需核对缓存偏移处的十几个字节即可，不必重新扫描整个文件。
+# ==============================================================================
+_SCAN_CACHE_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'covdb-patcher', 'scan-cache.json',
+)
+
+
+def _scan_cache_key(file_path: str) -> Optional[str]:
+    """生成文件的缓存键，文件无法stat时返回None"""
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return f"{os.path.realpath(file_path)}|{st.st_dev}|{st.st_ino}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def _load_scan_cache() -> _ScanCache:
+    """读取缓存文件，不存在或已损坏时返回空字典"""
+    try:
+        with open(_SCAN_CACHE_PATH, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _store_scan_result(cache: _ScanCache, file_path: str, version_string: str,
+                       offset: int, patched: bool, detected: bool) -> None:
+    """
+    把一次扫描结果记入 cache 并写回缓存文件（按文件当前的stat生成键）；
+    缓存只是加速手段，写入失败时静默忽略。
+
+    detected 表示版本号是自动识别出来的，而不是用户通过 -v 指定的；
+    只有这样的记录才能直接作为自动识别的结果。
+    """
+    cache_key = _scan_cache_key(file_path)
+    if cache_key is None:
+        return
+    path_prefix = cache_key.split('|', 1)[0] + '|'
+    stale_keys = [k for k in cache if k.startswith(path_prefix)]
+    # 之前已自动识别出同一版本时保留该标记，-v 指定相同版本不会让它失效
+    detected = detected or any(
+        cache[k].get('version') == version_string and cache[k].get('detected') is True
+        for k in stale_keys if isinstance(cache[k], dict)
+    )
+    entry = {"version": version_string, "offset": offset, "patched": patched, "detected": detected}
+    if cache.get(cache_key) == entry:
+        return
+    # 同一路径的旧记录（文件已被修改）不再有效，顺便清理掉
+    for stale_key in stale_keys:
+        del cache[stale_key]
+    cache[cache_key] = entry
+    tmp_path = f"{_SCAN_CACHE_PATH}.tmp.{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(_SCAN_CACHE_PATH), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        # 先写临时文件再替换，避免并发运行时读到写了一半的缓存
+        os.replace(tmp_path, _SCAN_CACHE_PATH)
+    except OSError:
+        pass
+
+
+def _cached_patch(cache: _ScanCache, file_path: str) -> Optional[Tuple[Patch, int]]:
+    """
+    返回缓存中此前自动识别出的 (补丁, 偏移)，格式与 detect_patch 相同。
+    没有记录，或记录的版本来自 -v 指定时返回None。
+    """
+    cache_key = _scan_cache_key(file_path)
+    entry = cache.get(cache_key) if cache_key else None
+    if (not isinstance(entry, dict) or entry.get('detected') is not True
+            or not isinstance(entry.get('version'), str) or not isinstance(entry.get('offset'), int)):
+        return None
+    patch = find_patch(entry['version'])
+    return (patch, entry['offset']) if patch is not None else None
+
+
+def _patch_mapped(mm: _Buffer, file_path: str, patch_info: Patch, in_place: bool,
+                  known_offset: Optional[int], cache: _ScanCache) -> bool:
+    """
+    在已映射的文件上执行校验与补丁。
+
+    所有搜索都直接使用 mm.find：CPython 的 fastsearch 在 C 层已带有
+    Horspool 式的坏字符跳跃（长模式串时改用 Two-Way），版本不匹配时
+    同样能按模式串长度跳过，无需再用纯 Python 实现跳跃表。
+
+    注意不要改用 `in` 或 bytes(mm)：mmap 上的 `in` 是逐个字节比较，
+    对多字节串永远返回 False；bytes(mm) 则会把整个文件复制进内存。
+    Python 3.10 之前 mmap.find 是 C 层逐位置 memcmp，仍然正确且不复制
+    文件，只是没有跳跃优化，因此不做版本限制。
+    """
+    target_bytes = patch_info.target
+    replacement_bytes = patch_info.replacement
+    version_string = patch_info.description
+
+    # 有 known_offset 说明版本号是自动识别的，记录缓存时一并标记
+    detected = known_offset is not None
+
+    # 命中缓存且缓存偏移处的字节仍然吻合时，跳过全部扫描
+    cache_key = _scan_cache_key(file_path)
+    entry = cache.get(cache_key) if cache_key else None
+    if isinstance(entry, dict) and entry.get('version') == version_string:
+        offset = entry.get('offset')
+        if isinstance(offset, int) and offset >= 0:
+            window = mm[offset:offset + len(target_bytes)]
+            if entry.get('patched') and window == replacement_bytes:
+                print(f"[*] Cached scan result matches the file (replacement at offset 0x{offset:x}).")
+                print("[*] The file appears to be already patched. No action needed.")
+                return True
+            if not entry.get('patched') and window == target_bytes:
+                print(f"[*] Cached scan result matches the file (target at offset 0x{offset:x}).")
+                return _write_and_record(cache, file_path, patch_info, offset, in_place, detected)
+
+    # detect_patch 已确认版本号并找到目标串（或替换串）时，不再重复搜索
+    if known_offset is not None:
+        window = mm[known_offset:known_offset + len(target_bytes)]
+        if window == target_bytes:
+            return _patch_at(mm, file_path, patch_info, in_place, known_offset, cache, detected)
+        if window == replacement_bytes:
+            _store_scan_result(cache, file_path, version_string, known_offset, True, detected)
+            print("\n[*] Info: The replacement byte sequence already exists in the file.")
+            print("[*] The file appears to be already patched. No action needed.")
+            return True
 
     # =================== 新增功能：版本号校验 ===================
-    # 将版本描述字符串编码为字节，然后在二进制文件中查找
-    version_bytes = version_string.encode('ascii')
-    # print(version_bytes)
-    if version_bytes not in original_data:
+    # 在二进制文件中查找版本描述字符串
+    if _match_version(mm, [patch_info], _rodata_range(mm)) is None:
         print(f"\n[!] ERROR: Version mismatch or incorrect file selected.")
         print(f"[!] The version string '{version_string}' was NOT found inside the file '{file_path}'.")
         print(f"[!] Please ensure you are patching the correct file and have selected the right version.")
@@ -148,38 +476,91 @@ def apply_patch(file_path: str, patch_info: Dict[str, Any]) -> bool:
         print(f"[*] Version check passed. Found '{version_string}' in the file.")
     # =====================================================================
 
-    # 检查是否已被Patch
-    if replacement_bytes in original_data:
-        print("\n[*] Info: The replacement byte sequence already exists in the file.")
-        print("[*] The file appears to be already patched. No action needed.")
-        return True
-
-    occurrence_count = original_data.count(target_bytes)
-    if occurrence_count == 0:
+    # 只查找目标指令串一次，找到后从其下一字节开始再查一次以检查是否唯一
+    offset = mm.find(target_bytes)
+    if offset == -1:
+        # 未找到目标时才检查是否已被Patch
+        replacement_offset = mm.find(replacement_bytes)
+        if replacement_offset != -1:
+            _store_scan_result(cache, file_path, version_string, replacement_offset, True, detected)
+            print("\n[*] Info: The replacement byte sequence already exists in the file.")
+            print("[*] The file appears to be already patched. No action needed.")
+            return True
         print("\n[!] Patch failed: Target instruction sequence not found in the file.")
         print("[!] The file seems to be the correct version, but the specific byte sequence to be patched was not found.")
         return False
 
-    print(f"[*] Found {occurrence_count} occurrence(s) of the target sequence.")
-    if occurrence_count > 1:
+    return _patch_at(mm, file_path, patch_info, in_place, offset, cache, detected)
+
+
+def _patch_at(mm: _Buffer, file_path: str, patch_info: Patch, in_place: bool, offset: int,
+              cache: _ScanCache, detected: bool) -> bool:
+    """目标串已在 offset 处找到：检查是否唯一，然后写出补丁"""
+    target_bytes = patch_info.target
+    if mm.find(target_bytes, offset + 1) != -1:
         print("[!] Warning: Multiple occurrences found. Aborting to prevent potential mis-patching.")
         print("[!] Please manually verify the target offsets with a tool like 'objdump'.")
         return False
 
-    patched_data = original_data.replace(target_bytes, replacement_bytes, 1)
+    print(f"[*] Found 1 occurrence of the target sequence at offset 0x{offset:x}.")
+    return _write_and_record(cache, file_path, patch_info, offset, in_place, detected)
+
 
-    if patched_data == original_data:
-        print("\n[!] Patch failed: Data remained unchanged after replacement attempt.", file=sys.stderr)
+def _write_and_record(cache: _ScanCache, file_path: str, patch_info: Patch, offset: int,
+                      in_place: bool, detected: bool) -> bool:
+    """写出补丁结果，并按写入后原文件的状态更新扫描结果缓存"""
+    if not in_place:
+        # 原文件保持不变，记录为未Patch
+        _store_scan_result(cache, file_path, patch_info.description, offset, False, detected)
+        return _write_patched(file_path, patch_info.replacement, offset)
+    if not _write_in_place(file_path, patch_info.replacement, offset):
         return False
+    # 覆写后原文件的mtime已变化，按新的stat记录为已Patch
+    _store_scan_result(cache, file_path, patch_info.description, offset, True, detected)
+    return True
 
+
+def _write_patched(file_path: str, replacement_bytes: bytes, offset: int) -> bool:
+    """生成 .patched 文件：复制原文件后只覆写补丁处的字节"""
     output_path = file_path + ".patched"
+    # 先写到同目录下的临时文件，完成后再原子地重命名，
+    # 进程中途被杀掉时不会留下截断的 .patched 文件
+    tmp_path = f"{output_path}.tmp.{os.getpid()}"
     try:
-        with open(output_path, 'wb') as f:
-            f.write(patched_data)
+        # 先整体复制原文件（Linux下copyfile会使用copy_file_range/sendfile），
+        # 由于target与replacement等长，只需在匹配偏移处覆写这几个字节
+        shutil.copyfile(file_path, tmp_path)
+        fd = os.open(tmp_path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, replacement_bytes, offset)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, output_path)
         print(f"\n[+] Success! Patched file saved to: {output_path}")
         return True
     except IOError as e:
         print(f"Error writing to output file '{output_path}': {e}", file=sys.stderr)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+
+
+def _write_in_place(file_path: str, replacement_bytes: bytes, offset: int) -> bool:
+    """直接在原文件的补丁偏移处覆写替换字节，I/O 只有这十几个字节"""
+    try:
+        fd = os.open(file_path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, replacement_bytes, offset)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        print(f"\n[+] Success! Patched file in place: {file_path}")
+        return True
+    except IOError as e:
+        print(f"Error writing to file '{file_path}': {e}", file=sys.stderr)
         return False
 
 
@@ -190,6 +571,17 @@ def main():
         formatter_class=argparse.RawTextHelpFormatter
     )
     parser.add_argument("so_file", help="The path to the .so file to be patched.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("-v", "--version",
+                      help="Patch version to apply, given as its description\n"
+                           "(e.g. 'X-2025.06-SP1') or its 1-based menu index.")
+    mode.add_argument("--auto", action="store_true",
+                      help="Detect the patch version from the file and fail instead\n"
+                           "of falling back to the interactive menu.")
+
+    parser.add_argument("--in-place", action="store_true",
+                        help="Overwrite the patched bytes directly in so_file instead of\n"
+                             "writing so_file.patched. Close all Verdi processes first.")
 
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
@@ -197,10 +589,40 @@ def main():
 
     args = parser.parse_args()
 
-    display_patches()
-    selected_patch = select_patch()
+    known_offset = None
+    # 扫描结果缓存在整个运行中只读取一次
+    cache = _load_scan_cache()
+    if args.version is not None:
+        selected_patch = find_patch(args.version)
+        if selected_patch is None:
+            print(f"Error: Unknown patch version '{args.version}'.", file=sys.stderr)
+            display_patches()
+            sys.exit(1)
+    else:
+        # 缓存中只有自动识别得到的记录才会被采用，-v 的结果不会冒充识别结果
+        detected = _cached_patch(cache, args.so_file)
+        if detected is None:
+            with _open_mapped(args.so_file) as mm:
+                if mm is None or not _check_elf_header(mm, args.so_file):
+                    sys.exit(1)
+                detected = detect_patch(mm)
+        if detected is not None:
+            selected_patch, known_offset = detected
+        else:
+            selected_patch = None
+
+        if selected_patch is not None:
+            print(f"[*] Auto-detected patch version: '{selected_patch.description}'")
+        elif args.auto:
+            print("Error: Could not auto-detect the patch version.", file=sys.stderr)
+            sys.exit(1)
+        else:
+            print("[*] Could not auto-detect the patch version. Please select it manually.")
+            display_patches()
+            selected_patch = select_patch()
 
-    if apply_patch(args.so_file, selected_patch):
+    if apply_patch(args.so_file, selected_patch, in_place=args.in_place,
+                   known_offset=known_offset, cache=cache):
         sys.exit(0)
     else:
         sys.exit(1)